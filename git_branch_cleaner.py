@@ -3,12 +3,35 @@
     Written and released by Serdar Dalgic <sd AT serdardalgic DOT org>
 
 """
+from __future__ import annotations
+
+import asyncio
 import re
-import shlex
 import sys
-from subprocess import Popen, PIPE
+import threading
+
+import dateparser
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import chain
+from os import cpu_count
+from shutil import which
+from subprocess import Popen, PIPE, run
 import argparse
 
+try:
+    # DFA-backed drop-in for re; matches large logs in one linear
+    # pass with no backtracking.
+    import re2 as _re
+except ImportError:
+    import re as _re
+
+# Strings between single quotes, e.g. the branch names in
+# "Merge branches 'br1' and 'br2' into r13110401".
+_SQUOTE_RE = _re.compile(r"'([^']+)'")
+
 
 class BranchCleanerError(Exception):
     pass
@@ -16,26 +39,25 @@ class BranchCleanerError(Exception):
 
 ###################### HELPER FUNCTIONS ########################
 
-def run_cmd(command, shell=False, splitter=None, stripped=True):
+def run_cmd(argv: list[str], splitter: str = None, stripped: bool = True):
     """
-    Run the given command, wait until the command is executed, then,
+    Run the given argv list, wait until the command is executed, then,
     if the process is succesful, return the result list. If splittter is
     provided, return splitted result.
 
-    shlex is used for parsing the command. See below link for details.
-    http://docs.python.org/2/library/subprocess.html#popen-constructor
+    argv goes to subprocess.run as-is: no shell, no tokenization, so
+    branch names with spaces or metacharacters cannot break the command.
     """
-    p = Popen(shlex.split(command), shell=shell, stdout=PIPE, stderr=PIPE)
-    (stdout, stderr) = p.communicate()
-    if stderr:
-        print stderr
+    p = run(argv, capture_output=True, text=True, check=False)
+    if p.stderr:
+        print(p.stderr)
         raise BranchCleanerError(p.returncode)
         #sys.exit(p.returncode)
     #check stripped status
     if stripped:
-        rv = stdout.strip()
+        rv = p.stdout.strip()
     else:
-        rv = stdout
+        rv = p.stdout
 
     if not splitter:
         return rv
@@ -47,222 +69,302 @@ def run_cmd(command, shell=False, splitter=None, stripped=True):
         return rv.split(splitter)
 
 
-def get_external_prog(prog):
-    """
-    Return the external program's path via 'which' UNIX command.
-    If not found, print an error message and exit.
-    """
-    PROG = run_cmd('which ' + prog)
-    if not PROG:
-        print "**************************************************"
-        print "%s command not found on the server." % prog
-        print "please inform the sysadmins about this situation!"
-        print "**************************************************"
-        sys.exit(-4)
-    return PROG
-
-GIT = get_external_prog('git')
+# shutil.which is pure Python and cross-platform; no fork/exec just
+# to locate the binary at import time.
+GIT = which('git')
+if not GIT:
+    print("**************************************************")
+    print("git command not found on the server.")
+    print("please inform the sysadmins about this situation!")
+    print("**************************************************")
+    sys.exit(-4)
 
 
-def list_tracked_repos():
+@lru_cache(maxsize=1)
+def tracked_repos() -> frozenset[str]:
     """
-    Returns a list of names of tracking repos.
+    Returns the frozenset of tracking repo names, so membership
+    checks are O(1) and repeated calls cost no subprocess.
     e.g.:
     $> git remote
     origin
     upstream
     backup
     """
-    cmd_str = GIT + ' remote'
-    return run_cmd(cmd_str, splitter='__ALL_WHITE_SPACES__')
+    return frozenset(run_cmd([GIT, 'remote'],
+                             splitter='__ALL_WHITE_SPACES__'))
 
 
-def get_current_branch():
+def get_current_branch() -> str:
     """
     Get current branch:
     returns the name of the branch e.g.:
     $> git rev-parse --abbrev-ref HEAD
     master
     """
-    cmd_str = GIT + ' rev-parse --abbrev-ref HEAD'
-    return run_cmd(cmd_str)
+    return run_cmd([GIT, 'rev-parse', '--abbrev-ref', 'HEAD'])
 
 
-def checkout_branch(branch):
+def checkout_branch(branch: str) -> None:
     """
     Checks out to the target branch
     $> git checkout -q master
     """
-    cmd_str = GIT + " checkout -q " + branch
-    run_cmd(cmd_str)
+    run_cmd([GIT, 'checkout', '-q', branch])
 
 
-def checkout_branch_with_new_name(new_name, src_repo, branch):
+def fetch_repo(repo: str) -> None:
     """
-    Checks out remote branch with a new name
-    $> git checkout -b branch_to_clean origin/anotherbranch
+    Fetch unless --no-fetch is given.
+    e.g.:
+    $> git fetch -q origin
     """
-    cmd_str = (GIT + " checkout -q -b " + new_name + " " +
-               src_repo + "/" + branch)
-    run_cmd(cmd_str)
+    run_cmd([GIT, 'fetch', '-q', repo])
 
 
-def fetch_repo(repo):
+def invalidate_git_caches() -> None:
     """
-    Fetch unless --no-fetch is given.
-    e.g.:
-    $> git fetch -q origin
+    Drops the memoized git query results. Must be called after
+    anything that mutates repository state (fetch, checkout), so the
+    caches never serve stale refs.
     """
-    cmd_str = GIT + " fetch -q " + repo
-    run_cmd(cmd_str)
+    tracked_repos.cache_clear()
 
 
-def calculate_dates(period):
+def calculate_dates(period: str) -> tuple[int, str, str]:
     """
-    Sets the dates according to the given period.
-    See following links for period parameter examples:
+    Sets the dates according to the given period, parsed in process
+    with dateparser. No fork/exec, and no dependency on the
+    GNU-specific `date --date=` (which breaks on BSD/OS X).
+    Period examples are the same relative/exact formats as before:
     http://goo.gl/OH4eZ3
     cyberciti.biz/tips/linux-unix-get-yesterdays-tomorrows-date.html
 
+    e.g. for period "1 year ago":
     return_val1 : 1353317905
-    return_val2 : Mon Nov 19 11:38:14 EET 2012
+    return_val2 : Mon Nov 19 11:38:14 2012
+    return_val3 : 2012-11-19T11:38:14
     """
-    # Raw Date for date comparison
-    # e.g.:
-    # $> date --date="1 year ago" +%s
-    # 1353317905
-    #
-    cmd_str = "date --date=\"" + period + "\" +\%s"
-    date = run_cmd(cmd_str)
-    # Human Readable Date
-    # e.g.:
-    # $> date --date="1 year ago"
-    # Mon Nov 19 11:38:14 EET 2012
-    #
-    cmd_str = "date --date=\"" + period + "\""
-    human_date = run_cmd(cmd_str)
-    return date, human_date
-
-
-def get_list_of_branches(src_repo, target_branch,
-                         merge_st, regex=""):
+    parsed = dateparser.parse(period)
+    if parsed is None:
+        raise BranchCleanerError("Can not parse the period: " + period)
+    date = int(parsed.timestamp())
+    human_date = parsed.strftime('%a %b %d %H:%M:%S %Y')
+    # ISO 8601 form, so git parses --before= deterministically.
+    return date, human_date, parsed.isoformat()
+
+
+def get_list_of_branches(src_repo: str, target_branch: str,
+                         merge_st: str) -> list[tuple[str, int | None]]:
     """
-    Finds branches in the selected merge_st, compared
-    with source_repo/target_branch
+    Finds branches in the selected merge_st, compared with
+    source_repo/target_branch, together with their last commit times,
+    fused into a single git call:
     e.g.:
-    $> git branch --list origin* -r --merged origin/master
-    origin/branchname1
-    origin/branchname2
-    origin/branchname3
+    $> git for-each-ref refs/remotes/origin/ --merged origin/master
+    --format='%(refname:short)|%(committerdate:unix)'
+    origin/branchname1|1384871928
+    origin/branchname2|1335373535
     ...
+    Returns a list of (branch, unix_ts) tuples with the timestamps
+    already parsed to int, so nothing downstream re-parses them.
     """
     merge_param_dict = {'merged': "--merged",
                         'unmerged': "--no-merged",
-                        'both': ""}
-    cmd_str = (GIT + " branch --list " + regex + " -r "
-               + merge_param_dict[merge_st] + " " + src_repo
-               + "/" + target_branch)
-    return run_cmd(cmd_str, splitter='__ALL_WHITE_SPACES__')
-
-
-def get_reflog_data(branch):
+                        'both': None}
+    argv = [GIT, 'for-each-ref', f'refs/remotes/{src_repo}/',
+            '--format=%(refname:short)|%(committerdate:unix)']
+    if merge_param_dict[merge_st]:
+        argv += [merge_param_dict[merge_st], f"{src_repo}/{target_branch}"]
+    branch_times = []
+    for line in run_cmd(argv, splitter='\n'):
+        if not line:
+            continue
+        branch, _, unix_ts = line.partition('|')
+        branch_times.append((branch, int(unix_ts) if unix_ts else None))
+    return branch_times
+
+
+async def _get_reflog_time(sem: asyncio.Semaphore, branch: str):
     """
-    If there is a reflog info about origin/branchname, it will print smt like
-    this:
+    If there is a reflog info about origin/branchname, git prints smt
+    like this:
     e.g.:
     $> git log -g -n 1 --date=raw --pretty=%gd origin/branchname
     origin/branchname@{1384871928 +0200}
+    Returns a (branch, timestamp) tuple; the timestamp is None when
+    the branch is too old to have reflog data.
     """
+    async with sem:
+        proc = await asyncio.create_subprocess_exec(
+            GIT, 'log', '-g', '-n', '1', '--date=raw', '--pretty=%gd',
+            branch, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await proc.communicate()
+    if stderr:
+        print(stderr.decode())
+        raise BranchCleanerError(proc.returncode)
+    reflog_data = stdout.decode().strip().split('{')
+    if reflog_data == ['']:
+        return branch, None
+    return branch, int(reflog_data[1].split(' ')[0])
 
-    cmd_str = GIT + " log -g -n 1 --date=raw --pretty=%gd " + branch
-    return run_cmd(cmd_str, splitter='{')
 
+def gather_reflog_times(branches: list[str]) -> dict[str, int | None]:
+    """
+    Queries the reflogs of all given branches concurrently. Each
+    await overlaps git's fork/exec and I/O with the other queries;
+    the semaphore bounds the in-flight subprocesses so a large branch
+    list cannot exhaust file descriptors.
+    """
+    async def _gather():
+        sem = asyncio.Semaphore(min(8, max(1, 3 * (cpu_count() or 1) // 4)))
+        return await asyncio.gather(
+            *(_get_reflog_time(sem, branch) for branch in branches))
+    return dict(asyncio.run(_gather()))
 
-def get_latest_commit_time(branch):
+
+class GitBatch:
     """
-    grab the latest commit time for comparing the branch
-    e.g.:
-    $> git show -s --format="%ct" origin/branch_name
-    1335373535
+    Long-running `git cat-file --batch` helper process.
+
+    Forking a fresh git for every single ref lookup costs tens of
+    milliseconds per call; one cat-file process kept open for the
+    whole run answers any number of queries over its stdin/stdout
+    pipes and amortizes the exec overhead away.
     """
-    cmd_str = GIT + " show -s --format=\"%ct\" " + branch
-    return run_cmd(cmd_str)
 
+    def __init__(self):
+        self.proc = Popen([GIT, 'cat-file', '--batch'],
+                          stdin=PIPE, stdout=PIPE, bufsize=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-def grep_merge_commits(period):
+    def commit_time(self, ref: str) -> int:
+        """
+        Return the committer time of the commit `ref` points to, the
+        in-process equivalent of:
+        $> git show -s --format="%ct" origin/branch_name
+        1335373535
+        """
+        # The pipes stay binary: the object size reported by git is in
+        # bytes, which a text-mode read() would miscount.
+        self.proc.stdin.write(ref.encode() + b"\n")
+        header = self.proc.stdout.readline().decode().strip()
+        if header.endswith("missing"):
+            raise BranchCleanerError(header)
+        obj_size = int(header.split(' ')[2])
+        # The object body is followed by a single newline.
+        body = self.proc.stdout.read(obj_size + 1).decode('utf-8', 'replace')
+        for line in body.split('\n'):
+            if line.startswith("committer "):
+                return int(line.split(' ')[-2])
+        raise BranchCleanerError(header)
+
+    def close(self) -> None:
+        if self.proc:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+
+def grep_merge_commits(before: str) -> Iterator[str]:
     """
     Greps in the git log for the commit messages like these:
         Merge branches 'branch1', 'branch2' and 'branch3' into release_branch
+    `before` is an ISO 8601 date from calculate_dates.
     e.g.:
-    $> git log --grep='^Merge branches.*into' --before='3 months ago'
+    $> git log --grep='^Merge branches.*into' --before='2012-11-19T11:38:14'
     --pretty='format: %s'
         Merge branches 'br1' and 'br2' into r13110401
         Merge branches 'br3' and 'br5' into r13102604
         Merge branches 'br11' and 'branchsmt' into r13101001
     ...
+    The subjects are yielded one by one instead of buffering the
+    whole log: memory stays constant however long the history is, and
+    the regex work downstream overlaps with git still walking it.
     """
-    cmd_str = (GIT + " log --grep='^Merge branches.*into' "
-               "--before='" + period
-               + "' --pretty='format: %s'")
-    return run_cmd(cmd_str, splitter='\n ')
+    proc = Popen([GIT, 'log', '--grep=^Merge branches.*into',
+                  '--before=' + before, '--pretty=format: %s'],
+                 stdout=PIPE, bufsize=1, text=True)
+    for line in proc.stdout:
+        yield line.strip()
+    if proc.wait() != 0:
+        raise BranchCleanerError(proc.returncode)
 
 
-def copy_branch_to_backup(source_repo, backup_repo,
-                          target_branch, branch_name):
+def copy_branch_to_backup(source_repo: str, backup_repo: str,
+                          branch_name: str) -> None:
     """
-    Copies a branch from source_repo to the backup_repo:
-        1) First, checks out from source_repo with the name:
-            "br_clean_backup_branch_name"
-    e.g.:
-    $> git checkout -q -b br_clean_backup_some_branch origin/some_branch
-
-        2) Pushes the branch to the backup_repo with branch_name.
+    Copies a branch from source_repo to the backup_repo by pushing
+    the remote-tracking ref directly; no temporary local branch, no
+    working-tree churn, and safe to run concurrently.
     e.g.:
-    $> git push backup br_clean_backup_some_branch:some_branch
-
-        3) Checks out to target_branch to remove the created local branch
-    e.g.:
-    $> git checkout -q master
-
-        4) Deletes the newly created local branch.
-    e.g.:
-    $> git branch -D br_clean_backup_some_branch
+    $> git push -q backup origin/some_branch:refs/heads/some_branch
     """
-    BACKUP_PREFIX = "br_clean_backup_"
-    local_name = BACKUP_PREFIX + branch_name
-    checkout_branch_with_new_name(local_name, source_repo, branch_name)
-
     # No need for this try-except after remote messages from Gitorious
     # are silenced.
     try:
-        cmd_str = (GIT + " push -q " + backup_repo + " " +
-                   local_name + ":" + branch_name)
-        run_cmd(cmd_str)
+        run_cmd([GIT, 'push', '-q', backup_repo,
+                 f"{source_repo}/{branch_name}:refs/heads/{branch_name}"])
     except BranchCleanerError as e:
-        if e.message != 0:
+        if e.args[0] != 0:
             raise BranchCleanerError
 
-    checkout_branch(target_branch)
 
-    cmd_str = (GIT + " branch -q -D " + local_name)
-    run_cmd(cmd_str)
+# Refspecs per delete push; keeps the command line well under
+# ARG_MAX and plays nice with server-side refspec limits.
+DELETE_CHUNK_SIZE = 50
 
 
-def delete_branch(source_repo, branch_name):
+def delete_branches(source_repo: str,
+                    branch_names: list[str]) -> tuple[list[str], list[str]]:
     """
-    Deletes the given branch --> origin/branch_name
+    Deletes the given branches with a single atomic push, one network
+    round trip instead of one per branch:
     e.g.:
-    $> git push -q --delete origin branch1 branch2
+    $> git push -q --atomic --delete origin branch1 branch2
+
+    With --atomic the push either deletes every ref or none, so on
+    failure the offending refs can be read off stderr and the
+    remainder retried without them. Returns a tuple of
+    (already_removed, problematic) branch lists; branches in neither
+    list have been deleted successfully.
     """
-    # No need for this try-except after remote messages from Gitorious
-    # are silenced.
-    try:
-        cmd_str = (GIT + " push -q --delete "
-                   + source_repo + " " + branch_name)
-        run_cmd(cmd_str)
-    except BranchCleanerError as e:
-        if e.message != 0:
-            raise BranchCleanerError
+    already_removed = []
+    problematic = []
+    pending = list(branch_names)
+    while pending:
+        p = run([GIT, 'push', '-q', '--atomic', '--delete', source_repo]
+                + pending, capture_output=True, text=True, check=False)
+        if p.returncode == 0:
+            break
+        offenders = []
+        for line in p.stderr.splitlines():
+            # error: unable to delete 'branch1': remote ref does not exist
+            match = re.search(r"unable to delete '([^']+)'", line)
+            if match:
+                already_removed.append(f"{source_repo}/{match.group(1)}")
+                offenders.append(match.group(1))
+                continue
+            #  ! [remote rejected] branch2 (some reason)
+            match = re.search(r"\[remote rejected\]\s+(\S+)\s+\((.*)\)", line)
+            # Innocent refs are rejected with '(atomic push failed)';
+            # they stay pending for the retry.
+            if match and match.group(2) != "atomic push failed":
+                problematic.append(f"{source_repo}/{match.group(1)}")
+                offenders.append(match.group(1))
+        if not offenders:
+            # Nothing attributable (e.g. the remote is unreachable);
+            # give up on the whole batch.
+            problematic.extend(f"{source_repo}/{name}" for name in pending)
+            break
+        pending = [name for name in pending if name not in offenders]
+    return already_removed, problematic
 
 
 ################### END OF HELPER FUNCTIONS ########################
@@ -272,13 +374,14 @@ class BranchCleaner():
 
     def __init__(self):
         self.parse_args()
+        self.git_batch = GitBatch()
         self.branches_to_delete_set = set()
-        # newer_branches_set is for debugging purposes.
-        self.newer_branches_set = set()
         self.prepare_branch()
         if not self.args.no_fetch:
             fetch_repo(self.args.source_repo)
-        self.date, self.human_date = calculate_dates(self.args.period)
+        invalidate_git_caches()
+        self.date, self.human_date, self.iso_date = calculate_dates(
+            self.args.period)
         self.generate_whitelist_set()
 
     def parse_args(self):
@@ -331,7 +434,7 @@ class BranchCleaner():
         self.args = parser.parse_args()
         bc_repo = self.args.backup_repo
         if bc_repo:
-            if bc_repo not in list_tracked_repos():
+            if bc_repo not in tracked_repos():
                 parser.error(
                     "Backup Repo with name: " + bc_repo + ", is not "
                     "defined. \nBefore continuing, please add a repo "
@@ -343,8 +446,8 @@ class BranchCleaner():
     def prepare_branch(self):
         self.cur_branch = get_current_branch()
         if self.args.target_branch != self.cur_branch:
-            print ("** Checking out from " + self.cur_branch + " to "
-                   + self.args.target_branch + '\n')
+            print("** Checking out from " + self.cur_branch + " to "
+                  + self.args.target_branch + '\n')
             checkout_branch(self.args.target_branch)
             self.cur_branch = self.args.target_branch
 
@@ -352,40 +455,43 @@ class BranchCleaner():
         """
         Generates a list of whitelisted branches
         """
-        self.whitelist_set = set([
-            self.args.source_repo + "/" + self.args.target_branch,
-            self.args.source_repo + "/HEAD",
-            "->"])
-
-        for wbranch in self.args.wbranches:
-            self.whitelist_set.add(self.args.source_repo + "/" + wbranch)
-
-        # Check for source_repo/master
-        if (self.args.source_repo + "/master") not in self.whitelist_set:
-            self.whitelist_set.add(self.args.source_repo + "/master")
+        prefix = self.args.source_repo + "/"
+        self.whitelist_set = {
+            prefix + self.args.target_branch,
+            prefix + "HEAD",
+            prefix + "master",
+            "->",
+            *(prefix + wbranch for wbranch in self.args.wbranches),
+        }
 
     ##### END OF INIT FUNCTIONS #####
 
-    def filter_due_date(self, branches):
+    def filter_due_date(self, branch_times):
         """
         Filters the branches according to their ages.
-        For every branch:
-            First, checks the reflog data. If the branch is too old to have
-            a reflog data, then checks the latest commit date.
-        Every branch goes to either `branches_to_delete_set` or
-        `newer_branches_set` lists.
+        The last commit times arrive with the branch list itself (one
+        fused `git for-each-ref` call); branches whose timestamp came
+        back empty fall back to concurrent reflog queries (and the
+        cat-file batch process when there is no reflog either).
+        Branches older than the given period end up in
+        `branches_to_delete_set`.
         """
-        for branch in branches:
-            reflog_data = get_reflog_data(branch)
+        # Common no-op case (e.g. in CI): everything was whitelisted
+        # or there are no remote branches at all.
+        if not branch_times:
+            return
+        missing = [branch for branch, unix_ts in branch_times
+                   if unix_ts is None]
+        reflog_times = gather_reflog_times(missing) if missing else {}
+        for branch, last_changed_date in branch_times:
+            if last_changed_date is None:
+                last_changed_date = reflog_times[branch]
             #If the branch is too old to have reflog data
-            last_changed_date = get_latest_commit_time(
-                branch) if reflog_data == [''] \
-                else reflog_data[1].split(' ')[0]
+            if last_changed_date is None:
+                last_changed_date = self.git_batch.commit_time(branch)
 
-            if int(last_changed_date) < int(self.date):
+            if last_changed_date < self.date:
                 self.branches_to_delete_set.add(branch)
-            else:
-                self.newer_branches_set.add(branch)
 
     def pick_untracked_branches(self):
         """
@@ -400,12 +506,11 @@ class BranchCleaner():
         and finds all merged branches.
 
         """
-        commit_msg_strings = grep_merge_commits(self.args.period)
-        rv_branch_set = set()
-        for commit_str in commit_msg_strings:
-            # Find all strings between single quotes
-            rv_branch_set.update(re.findall(r"\'([^\']+)\'", commit_str))
-        return rv_branch_set
+        commit_msg_strings = grep_merge_commits(self.iso_date)
+        # Find all strings between single quotes
+        return set(chain.from_iterable(
+            _SQUOTE_RE.findall(commit_str)
+            for commit_str in commit_msg_strings))
 
     def add_untracked_merged_branches(self):
         """
@@ -419,15 +524,16 @@ class BranchCleaner():
             untracked_branches - self.whitelist_set)
 
     def create_cleaning_list(self):
-        regex = '"%s*"' % self.args.source_repo
-        branches = set(get_list_of_branches(
-            self.args.source_repo,
-            self.args.target_branch,
-            self.args.merge_status,
-            regex)) - self.whitelist_set
+        branch_times = [
+            (branch, unix_ts)
+            for branch, unix_ts in get_list_of_branches(
+                self.args.source_repo,
+                self.args.target_branch,
+                self.args.merge_status)
+            if branch not in self.whitelist_set]
 
         # filter merged branches due to the given period
-        self.filter_due_date(branches)
+        self.filter_due_date(branch_times)
         # Add untracked merged branches too (already filtered for the date)
         if self.args.merge_status != "unmerged":
             self.add_untracked_merged_branches()
@@ -437,79 +543,146 @@ class BranchCleaner():
             merge_status = ""
         else:
             merge_status = " " + self.args.merge_status
-        print ("There are " + str(len(self.branches_to_delete_set)) +
-               merge_status +
-               " branches that are older than " + self.human_date +
-               " and eligible to remove:")
+        print("There are " + str(len(self.branches_to_delete_set)) +
+              merge_status +
+              " branches that are older than " + self.human_date +
+              " and eligible to remove:")
         remove_br_list = list(self.branches_to_delete_set)
         remove_br_list.sort()
         for rm_branch in remove_br_list:
-            print "  ", rm_branch
+            print("  ", rm_branch)
 
     def confirm_deletion(self):
         if not self.args.backup_repo:
-            print ("\nWARNING! Backup repo is not stated. If you "
-                   "continue, branches will be completely deleted, "
-                   "and there is no turning back!")
+            print("\nWARNING! Backup repo is not stated. If you "
+                  "continue, branches will be completely deleted, "
+                  "and there is no turning back!")
         else:
-            print ("\nBefore deleting, branches are going to be copied "
-                   "to " + self.args.backup_repo + " repository.")
-        return raw_input(
+            print("\nBefore deleting, branches are going to be copied "
+                  "to " + self.args.backup_repo + " repository.")
+        return input(
             "\nDo you want to delete them all?(Y/N) ") in [
                 "y", "Y", "yes", "YES", "Yes"]
 
+    def _backup_one(self, rm_branch):
+        """
+        Backs up a single branch to the backup repo.
+        Returns an ('ok'|'already', rm_branch) tuple.
+        """
+        print("** Backing up " + rm_branch)
+        source_repo, _, branch_name = rm_branch.partition('/')
+        try:
+            copy_branch_to_backup(source_repo,
+                                  self.args.backup_repo,
+                                  branch_name)
+        except BranchCleanerError:
+            return ('already', rm_branch)
+        return ('ok', rm_branch)
+
     def clean_branches(self):
-        problematic_brs = []
+        """
+        Backs up branches_to_delete_set over a bounded worker pool
+        (the pushes are network round-trip bound, so they overlap;
+        the pool is capped to avoid exhausting fds) and deletes the
+        branches in batched atomic pushes. The two phases overlap: as
+        soon as a branch's backup push completes it joins a
+        thread-safe deque, and a consumer thread drains the deque in
+        batches of DELETE_CHUNK_SIZE, one 'git push --atomic
+        --delete' per batch. Without --backup the whole set is
+        enqueued at once and only the batched deletes run.
+        """
         already_removed_brs = []
-        for rm_branch in self.branches_to_delete_set:
-            print "** Removing " + rm_branch
+        deleted_already = []
+        deleted_problems = []
+        ready = deque()
+        ready_cond = threading.Condition()
+        producing = True
+
+        def drain_deletes():
+            while True:
+                with ready_cond:
+                    while producing and len(ready) < DELETE_CHUNK_SIZE:
+                        ready_cond.wait()
+                    if not ready and not producing:
+                        return
+                    batch = [ready.popleft() for _ in
+                             range(min(len(ready), DELETE_CHUNK_SIZE))]
+                branches_by_repo = {}
+                for rm_branch in batch:
+                    print("** Removing " + rm_branch)
+                    source_repo, _, branch_name = rm_branch.partition('/')
+                    branches_by_repo.setdefault(
+                        source_repo, []).append(branch_name)
+                for source_repo, branch_names in branches_by_repo.items():
+                    already, problems = delete_branches(
+                        source_repo, branch_names)
+                    deleted_already.extend(already)
+                    deleted_problems.extend(problems)
+
+        consumer = threading.Thread(target=drain_deletes)
+        consumer.start()
+        try:
             if self.args.backup_repo:
-                try:
-                    source_repo, branch_name = rm_branch.split('/')
-                    copy_branch_to_backup(source_repo,
-                                          self.args.backup_repo,
-                                          self.args.target_branch,
-                                          branch_name)
-                except BranchCleanerError:
-                    already_removed_brs.append(rm_branch)
-                    continue
-
-            try:
-                delete_branch(source_repo, branch_name)
-            except BranchCleanerError:
-                problematic_brs.append(rm_branch)
+                max_workers = min(8, max(1, 3 * (cpu_count() or 1) // 4))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(self._backup_one, rm_branch)
+                               for rm_branch in self.branches_to_delete_set]
+                    for future in as_completed(futures):
+                        status, rm_branch = future.result()
+                        if status == 'already':
+                            already_removed_brs.append(rm_branch)
+                        else:
+                            with ready_cond:
+                                ready.append(rm_branch)
+                                ready_cond.notify()
+            else:
+                with ready_cond:
+                    ready.extend(self.branches_to_delete_set)
+                    ready_cond.notify()
+        finally:
+            with ready_cond:
+                producing = False
+                ready_cond.notify()
+            consumer.join()
+
+        already_removed_brs.extend(deleted_already)
+        problematic_brs = deleted_problems
 
         if already_removed_brs:
-            print ("\nThese branches have already been removed, "
-                   "so no action has been taken for them:")
+            print("\nThese branches have already been removed, "
+                  "so no action has been taken for them:")
             for br in already_removed_brs:
-                print " ", br
+                print(" ", br)
 
         if problematic_brs:
-            print "\nThese branches could not be removed:"
+            print("\nThese branches could not be removed:")
             for br in problematic_brs:
-                print " ", br
+                print(" ", br)
         else:
-            print "\nAll is done!"
-        print 'Tell everyone to run `git fetch --prune` '
+            print("\nAll is done!")
+        print('Tell everyone to run `git fetch --prune` ')
         'to sync with this remote.\n'
-        print '(you don\'t have to, yours is synced.)'
+        print('(you don\'t have to, yours is synced.)')
+        self.git_batch.close()
 
 
 def main():
     cleaner = BranchCleaner()
-    cleaner.create_cleaning_list()
-    if not cleaner.branches_to_delete_set:
-        print ("There are no eligible branches to delete in the "
-               + cleaner.args.source_repo + " repository! \o/")
-        return
-    cleaner.print_cleaning_list()
-
-    if cleaner.args.dryrun:
-        return
-
-    if cleaner.args.force or cleaner.confirm_deletion():
-        cleaner.clean_branches()
+    try:
+        cleaner.create_cleaning_list()
+        if not cleaner.branches_to_delete_set:
+            print("There are no eligible branches to delete in the "
+                  + cleaner.args.source_repo + " repository! \o/")
+            return
+        cleaner.print_cleaning_list()
+
+        if cleaner.args.dryrun:
+            return
+
+        if cleaner.args.force or cleaner.confirm_deletion():
+            cleaner.clean_branches()
+    finally:
+        cleaner.git_batch.close()
 
 
 if __name__ == "__main__":